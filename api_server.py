@@ -5,25 +5,131 @@ Minimal Flask API server for testing
 
 import os
 import json
-import uuid
+import secrets
+import binascii
 import hashlib
+from base64 import b64encode, b64decode
+from dataclasses import dataclass, asdict
 from datetime import datetime, timedelta
+from typing import Optional
 from flask import Flask, request, jsonify, send_from_directory, Response
 from flask_cors import CORS
 
+from storage import SQLiteStore
+
 # Create a minimal Flask app
 app = Flask(__name__, static_folder="backend_static", static_url_path="")
 CORS(app)
 
+# Tune the stock JSON provider: skip key sorting and the ", "/": "
+# separators so every jsonify call serializes less and ships fewer bytes
+app.json.compact = True
+app.json.sort_keys = False
+
+
+@dataclass(slots=True)
+class Transaction:
+    """X402 payment transaction record"""
+    wallet_address: str
+    operation: str
+    file_hash: str
+    amount: str
+    amount_eth: float
+    status: str
+    created_at: str
+    expires_at: str
+    x402_protocol: str = "v1.0"
+    network: str = "ethereum"
+    tx_hash: Optional[str] = None
+    confirmed_at: Optional[str] = None
+
+
+@dataclass(slots=True)
+class PgnRecord:
+    """Metadata and content for an encoded PGN"""
+    pgn_id: str
+    file_hash: str
+    wallet_address: str
+    transaction_id: str
+    file_type: str
+    file_size: int
+    created_at: str
+    pgn_content: bytes
+
+
+def _dump_transaction(transaction: Transaction) -> str:
+    return json.dumps(asdict(transaction))
+
+
+def _load_transaction(raw: str) -> Transaction:
+    return Transaction(**json.loads(raw))
+
+
+def _dump_pgn_record(record: PgnRecord) -> str:
+    fields = asdict(record)
+    # PGN bodies are ASCII-armored bytes; latin-1 maps them 1:1 into str
+    fields["pgn_content"] = record.pgn_content.decode("latin-1")
+    return json.dumps(fields)
+
+
+def _load_pgn_record(raw: str) -> PgnRecord:
+    fields = json.loads(raw)
+    fields["pgn_content"] = fields["pgn_content"].encode("latin-1")
+    return PgnRecord(**fields)
+
+
+# Persistent stores (SQLite in WAL mode): O(1) indexed lookups that
+# survive restarts and are shared by all gunicorn workers
+# App-specific env var: app.py writes identically named tables with
+# incompatible schemas, so the two apps must never share one file
+DB_PATH = os.environ.get("ROOKHIDE_API_DB", "rookhide_api.db")
+transaction_store = SQLiteStore(DB_PATH, "transactions",
+                                dumps=_dump_transaction, loads=_load_transaction)
+pgn_metadata_store = SQLiteStore(DB_PATH, "pgn_records",
+                                 dumps=_dump_pgn_record, loads=_load_pgn_record)
+# Secondary index: file_hash -> pgn_id, so validate_pgn can answer
+# "have we encoded this file?" without scanning every record. Kept in
+# SQLite alongside the records so every worker sees writes made by the
+# others; a per-process dict went stale across the gunicorn pool.
+pgn_hash_store = SQLiteStore(DB_PATH, "pgn_hashes")
+# Backfill once for records written before the index table existed
+if len(pgn_hash_store) < len(pgn_metadata_store):
+    for record in pgn_metadata_store.values():
+        pgn_hash_store[record.file_hash] = record.pgn_id
+
+
+# Fixed validation-error payloads, serialized once at import and served
+# as cached bytes instead of re-running json.dumps per failed request
+ERR_WALLET_REQUIRED = json.dumps({
+    "error": "Wallet address required",
+    "code": "WALLET_REQUIRED",
+    "message": "Please connect your Coinbase Wallet first"
+}).encode()
+ERR_OPERATION_REQUIRED = json.dumps({
+    "error": "Operation required",
+    "code": "OPERATION_REQUIRED",
+    "message": "Please specify 'encode' or 'decode' operation"
+}).encode()
+ERR_FILE_HASH_REQUIRED = json.dumps({
+    "error": "File hash required",
+    "code": "FILE_HASH_REQUIRED",
+    "message": "File hash is required for payment verification"
+}).encode()
+ERR_INVALID_OPERATION = json.dumps({
+    "error": "Invalid operation",
+    "code": "INVALID_OPERATION",
+    "message": "Operation must be either 'encode' or 'decode'"
+}).encode()
 
-# In-memory storage for demo
-transaction_store = {}
-pgn_metadata_store = {}
+
+def json_error(body: bytes, status: int) -> Response:
+    """Return a precomputed JSON error payload"""
+    return Response(body, status=status, mimetype='application/json')
 
 
 def generate_transaction_id():
-    """Generate a unique transaction ID"""
-    return str(uuid.uuid4())
+    """Generate a unique transaction ID (128 bits, hex)"""
+    return secrets.token_hex(16)
 
 def validate_wallet_signature(wallet_address, signature, message):
     """Validate wallet signature (placeholder - implement actual validation)"""
@@ -96,49 +202,34 @@ def initiate_payment():
         file_hash = data.get('file_hash')
         
         if not wallet_address:
-            return jsonify({
-                "error": "Wallet address required",
-                "code": "WALLET_REQUIRED",
-                "message": "Please connect your Coinbase Wallet first"
-            }), 400
-            
+            return json_error(ERR_WALLET_REQUIRED, 400)
+
         if not operation:
-            return jsonify({
-                "error": "Operation required",
-                "code": "OPERATION_REQUIRED", 
-                "message": "Please specify 'encode' or 'decode' operation"
-            }), 400
-            
+            return json_error(ERR_OPERATION_REQUIRED, 400)
+
         if not file_hash:
-            return jsonify({
-                "error": "File hash required",
-                "code": "FILE_HASH_REQUIRED",
-                "message": "File hash is required for payment verification"
-            }), 400
-        
+            return json_error(ERR_FILE_HASH_REQUIRED, 400)
+
         if operation not in ['encode', 'decode']:
-            return jsonify({
-                "error": "Invalid operation",
-                "code": "INVALID_OPERATION",
-                "message": "Operation must be either 'encode' or 'decode'"
-            }), 400
+            return json_error(ERR_INVALID_OPERATION, 400)
         
         transaction_id = generate_transaction_id()
         payment_amounts = {"encode": "2000000000000000", "decode": "1000000000000000"}
         payment_amount = payment_amounts[operation]
-        
-        transaction_store[transaction_id] = {
-            "wallet_address": wallet_address,
-            "operation": operation,
-            "file_hash": file_hash,
-            "amount": payment_amount,
-            "amount_eth": float(int(payment_amount) / 1e18),
-            "status": "pending",
-            "created_at": datetime.now().isoformat(),
-            "expires_at": (datetime.now() + timedelta(minutes=15)).isoformat(),
-            "x402_protocol": "v1.0",
-            "network": "ethereum"
-        }
+
+        # One datetime.now() per request; derive the expiry from it
+        now = datetime.now()
+
+        transaction_store[transaction_id] = Transaction(
+            wallet_address=wallet_address,
+            operation=operation,
+            file_hash=file_hash,
+            amount=payment_amount,
+            amount_eth=float(int(payment_amount) / 1e18),
+            status="pending",
+            created_at=now.isoformat(),
+            expires_at=(now + timedelta(minutes=15)).isoformat()
+        )
         
         app.logger.info(f"X402 payment initiated: {transaction_id} for {operation} by {wallet_address}")
         
@@ -176,13 +267,15 @@ def verify_payment():
             return jsonify({"error": "Invalid transaction ID"}), 404
         
         transaction = transaction_store[transaction_id]
-        expires_at = datetime.fromisoformat(transaction["expires_at"])
-        if datetime.now() > expires_at:
+        now = datetime.now()
+        expires_at = datetime.fromisoformat(transaction.expires_at)
+        if now > expires_at:
             return jsonify({"error": "Transaction expired"}), 400
-        
-        transaction_store[transaction_id]["status"] = "confirmed"
-        transaction_store[transaction_id]["tx_hash"] = tx_hash
-        transaction_store[transaction_id]["confirmed_at"] = datetime.now().isoformat()
+
+        transaction.status = "confirmed"
+        transaction.tx_hash = tx_hash
+        transaction.confirmed_at = now.isoformat()
+        transaction_store[transaction_id] = transaction
         
         return jsonify({
             "success": True,
@@ -229,21 +322,24 @@ def encode_file():
             return jsonify({"error": "Invalid transaction ID"}), 400
         
         transaction = transaction_store[transaction_id]
-        if transaction["status"] != "confirmed":
-            app.logger.error(f"❌ Transaction not confirmed: {transaction['status']}")
+        if transaction.status != "confirmed":
+            app.logger.error(f"❌ Transaction not confirmed: {transaction.status}")
             return jsonify({"error": "Payment not confirmed"}), 400
-        
-        # Read file content
-        file_content = file.read()
+
+        # Hash the upload in C via file_digest (streams with an internal
+        # buffer instead of materializing the file twice in Python)
+        file.stream.seek(0)
+        content_hash = hashlib.file_digest(file.stream, "sha256").hexdigest()
+        file.stream.seek(0)
+        file_content = file.stream.read()
         app.logger.info(f"📄 File size: {len(file_content)} bytes")
-        
-        # Generate PGN ID and hash
+
+        # Generate PGN ID
         pgn_id = generate_transaction_id()
-        content_hash = hashlib.sha256(file_content).hexdigest()
         
         # Create a simple chess PGN with encoded data
         # In production, implement actual steganographic encoding
-        pgn_content = f"""[Event "ChessCrypt Encoded Message"]
+        pgn_header = f"""[Event "ChessCrypt Encoded Message"]
 [Site "ChessCrypt DApp"]
 [Date "{datetime.now().strftime('%Y.%m.%d')}"]
 [Round "1"]
@@ -264,20 +360,25 @@ def encode_file():
 35. Ra7 g6 36. Ra6+ Kc5 37. Ke1 Nf4 38. g3 Nxh3 39. Kd2 Kb5 40. Rd6 Kc5 41. Ra6 Nf2 
 42. g4 Bd3 43. Re6 1-0
 
-; Encoded data: {file_content.hex()}
-"""
-        
+; Encoded data (base64): """
+        # base64 carries the same payload in 4/3 of the input size versus
+        # 2x for hex, and b64encode loops in C; keeping the PGN as bytes
+        # avoids a UTF-8 re-encode in the Response path
+        pgn_content = b"".join([pgn_header.encode('ascii'),
+                                b64encode(file_content), b"\n"])
+
         # Store PGN metadata
-        pgn_metadata_store[pgn_id] = {
-            "pgn_id": pgn_id,
-            "file_hash": content_hash,
-            "wallet_address": wallet_address,
-            "transaction_id": transaction_id,
-            "file_type": file_type,
-            "file_size": len(file_content),
-            "created_at": datetime.now().isoformat(),
-            "pgn_content": pgn_content
-        }
+        pgn_metadata_store[pgn_id] = PgnRecord(
+            pgn_id=pgn_id,
+            file_hash=content_hash,
+            wallet_address=wallet_address,
+            transaction_id=transaction_id,
+            file_type=file_type,
+            file_size=len(file_content),
+            created_at=datetime.now().isoformat(),
+            pgn_content=pgn_content
+        )
+        pgn_hash_store[content_hash] = pgn_id
         
         app.logger.info(f"✅ Encoding completed successfully: {pgn_id}")
         
@@ -310,28 +411,26 @@ def validate_pgn():
         if file.filename == '':
             return jsonify({"error": "No file selected"}), 400
         
-        # Read PGN content
-        pgn_content = file.read().decode('utf-8')
-        file_hash = hashlib.sha256(pgn_content.encode()).hexdigest()
-        
+        # Work on the raw bytes: hashing and the marker scans below need
+        # no text semantics, so skip the UTF-8 decode/re-encode round trip
+        pgn_content = file.read()
+        file_hash = hashlib.sha256(pgn_content).hexdigest()
+
         app.logger.info(f"📄 Validating PGN file: {file.filename}")
         app.logger.info(f"🔐 File hash: {file_hash}")
-        
+
         # Basic PGN validation
-        is_valid_pgn = '[Event ' in pgn_content and '1.' in pgn_content
-        
+        is_valid_pgn = b'[Event ' in pgn_content and b'1.' in pgn_content
+
         # Check for ChessCrypt encoded data
         has_hidden_data = (
-            '[PGNId ' in pgn_content and 
-            '[FileHash ' in pgn_content and
-            '; Encoded data:' in pgn_content
+            b'[PGNId ' in pgn_content and
+            b'[FileHash ' in pgn_content and
+            b'; Encoded data' in pgn_content
         )
         
-        # Check if this PGN exists in our store
-        pgn_exists_in_store = any(
-            data['file_hash'] == file_hash 
-            for data in pgn_metadata_store.values()
-        )
+        # Check if this PGN exists in our store (O(1) via the hash index)
+        pgn_exists_in_store = file_hash in pgn_hash_store
         
         app.logger.info(f"✅ Validation results: valid={is_valid_pgn}, hidden={has_hidden_data}, in_store={pgn_exists_in_store}")
         
@@ -381,27 +480,43 @@ def decode_file():
             return jsonify({"error": "Invalid transaction ID"}), 400
         
         transaction = transaction_store[transaction_id]
-        if transaction["status"] != "confirmed":
-            app.logger.error(f"❌ Transaction not confirmed: {transaction['status']}")
+        if transaction.status != "confirmed":
+            app.logger.error(f"❌ Transaction not confirmed: {transaction.status}")
             return jsonify({"error": "Payment not confirmed"}), 400
-        
-        # Read PGN content
-        pgn_content = file.read().decode('utf-8')
-        app.logger.info(f"📄 PGN content length: {len(pgn_content)} characters")
-        
-        # Extract encoded data from PGN
-        encoded_data_marker = '; Encoded data: '
-        if encoded_data_marker not in pgn_content:
-            app.logger.error("❌ No encoded data found in PGN")
-            return jsonify({"error": "No hidden data found in PGN file"}), 400
-        
-        # Extract hex-encoded data
-        encoded_section = pgn_content.split(encoded_data_marker)[1].strip()
-        app.logger.info(f"🔐 Found encoded data section: {len(encoded_section)} characters")
-        
+
+        # Read PGN content as raw bytes; the payload is ASCII-armored so
+        # no UTF-8 decode of the (possibly large) document is needed
+        pgn_content = file.read()
+        app.logger.info(f"📄 PGN content length: {len(pgn_content)} bytes")
+
+        # Extract encoded data from PGN (base64 for current files, with a
+        # fallback for legacy hex-encoded PGNs)
+        b64_marker = b'; Encoded data (base64): '
+        hex_marker = b'; Encoded data: '
+        # The payload sits at the end of the PGN, so rfind + a slice grabs
+        # it without str.split copying the whole head of the document
+        marker_pos = pgn_content.rfind(b64_marker)
+        if marker_pos != -1:
+            encoded_section = pgn_content[marker_pos + len(b64_marker):].strip()
+            is_base64 = True
+        else:
+            marker_pos = pgn_content.rfind(hex_marker)
+            if marker_pos == -1:
+                app.logger.error("❌ No encoded data found in PGN")
+                return jsonify({"error": "No hidden data found in PGN file"}), 400
+            encoded_section = pgn_content[marker_pos + len(hex_marker):].strip()
+            is_base64 = False
+        app.logger.info(f"🔐 Found encoded data section: {len(encoded_section)} bytes")
+
         try:
-            # Convert hex back to bytes
-            decoded_bytes = bytes.fromhex(encoded_section)
+            if is_base64:
+                decoded_bytes = b64decode(encoded_section, validate=True)
+            else:
+                # Reject truncated hex before handing it to the C decoder
+                if len(encoded_section) % 2:
+                    app.logger.error("❌ Odd-length hex payload")
+                    return jsonify({"error": "Invalid encoded data format"}), 400
+                decoded_bytes = binascii.unhexlify(encoded_section)
             app.logger.info(f"✅ Successfully decoded {len(decoded_bytes)} bytes")
             
             # Return the decoded file as a download
@@ -442,18 +557,25 @@ def download_pgn(pgn_id):
         if pgn_id not in pgn_metadata_store:
             return jsonify({"error": "PGN not found"}), 404
         
-        pgn_data = pgn_metadata_store[pgn_id]
-        pgn_content = pgn_data["pgn_content"]
-        
-        from flask import Response
-        return Response(
-            pgn_content,
+        pgn_content = pgn_metadata_store[pgn_id].pgn_content
+
+        def stream_pgn(data=pgn_content, chunk_size=64 * 1024):
+            for offset in range(0, len(data), chunk_size):
+                yield data[offset:offset + chunk_size]
+
+        # Stream in 64 KiB chunks so the WSGI layer writes to the socket
+        # incrementally instead of queuing the whole body at once
+        response = Response(
+            stream_pgn(),
             mimetype='application/x-chess-pgn',
             headers={
                 'Content-Disposition': f'attachment; filename="{pgn_id}.pgn"',
-                'Content-Type': 'application/x-chess-pgn'
-            }
+                'Content-Type': 'application/x-chess-pgn',
+                'Content-Length': str(len(pgn_content))
+            },
+            direct_passthrough=True
         )
+        return response
         
     except Exception as e:
         app.logger.error(f"Download error: {str(e)}")
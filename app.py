@@ -1,49 +1,240 @@
+import functools
 import os
 import json
+import re
+import secrets
+import shutil
+import time
 import uuid
 import hashlib
-from datetime import datetime, timedelta
+from datetime import datetime
+from pathlib import Path
 from base64 import b64encode, b64decode
-from flask import Flask, request, render_template, send_file, jsonify
+from io import BytesIO
+from concurrent.futures import ProcessPoolExecutor
+from tempfile import SpooledTemporaryFile
+from flask import Flask, Request, Response, request, render_template, send_file, jsonify
 from flask_cors import CORS
+from werkzeug.exceptions import HTTPException
 from werkzeug.utils import secure_filename
 from encode import encode
 from decode import decode
+from storage import SQLiteStore
+
+
+class UploadRequest(Request):
+    """Request with multipart parsing tuned for large binary uploads"""
+
+    # Keep non-file form parts in memory up to 16 MiB instead of 500 KB
+    max_form_memory_size = 16 * 1024 * 1024
+
+    def _get_file_stream(self, total_content_length, content_type,
+                         filename=None, content_length=None):
+        # Spool uploaded parts in memory up to 16 MiB before falling back
+        # to a temp file, so typical uploads never touch disk twice
+        return SpooledTemporaryFile(max_size=16 * 1024 * 1024, mode='rb+')
+
+
 app = Flask(__name__, template_folder="templates", static_folder="static")
+app.request_class = UploadRequest
 CORS(app)  # Enable CORS for React frontend
+# Compact separators and no key sorting: smaller payloads and one less
+# pass over every dict jsonify serializes
+app.json.compact = True
+app.json.sort_keys = False
 
 UPLOAD_FOLDER = "uploads"
 OUTPUT_FOLDER = "outputs"
 STORAGE_FOLDER = "blockchain_storage"
-ALLOWED_EXTENSIONS = {'txt', 'png', 'jpeg', 'pgn'}
+ALLOWED_EXTENSIONS = frozenset({'txt', 'png', 'jpeg', 'pgn'})
+# Anchored alternation compiled once from the set above, so there is a
+# single place to add an extension; the per-upload check is one C-level
+# regex search with no intermediate string allocations
+_ALLOWED_RE = re.compile(
+    r'\.(?:' + '|'.join(map(re.escape, sorted(ALLOWED_EXTENSIONS))) + r')$',
+    re.IGNORECASE)
+
+# Path objects built once at import; handlers join against these instead
+# of re-running os.path.join + config lookups per request
+UPLOAD_DIR = Path(UPLOAD_FOLDER)
+OUTPUT_DIR = Path(OUTPUT_FOLDER)
+STORAGE_DIR = Path(STORAGE_FOLDER)
+ENCODE_CACHE_DIR = OUTPUT_DIR / "cache"
 
 # Create necessary directories
-for folder in [UPLOAD_FOLDER, OUTPUT_FOLDER, STORAGE_FOLDER]:
-    os.makedirs(folder, exist_ok=True)
+for folder in [UPLOAD_DIR, OUTPUT_DIR, STORAGE_DIR, ENCODE_CACHE_DIR]:
+    folder.mkdir(parents=True, exist_ok=True)
 
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['OUTPUT_FOLDER'] = OUTPUT_FOLDER
 app.config['STORAGE_FOLDER'] = STORAGE_FOLDER
+# Behind nginx/Apache, emit X-Sendfile so the proxy ships file responses
+# with zero-copy sendfile(2) instead of streaming bytes through Python
+app.config['USE_X_SENDFILE'] = (
+    os.environ.get('USE_X_SENDFILE', '').lower() in ('1', 'true', 'yes'))
+# nginx equivalent: map an internal location onto blockchain storage
+# (e.g. "/internal/blockchain_storage") and set this to its prefix
+X_ACCEL_REDIRECT_PREFIX = os.environ.get('X_ACCEL_REDIRECT_PREFIX', '').rstrip('/')
+# Reject oversized uploads at header time (413 via the existing handler)
+# before any body bytes are read or written to disk
+app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
+
+# SQLite-backed stores shared across workers: every gunicorn worker
+# sees the same transactions and PGN metadata, and records survive
+# restarts, which the per-process dicts did not
+# App-specific env var: api_server.py writes identically named tables
+# with incompatible schemas, so the two apps must never share one file
+DB_PATH = os.environ.get("ROOKHIDE_APP_DB", "rookhide_app.db")
+transaction_store = SQLiteStore(DB_PATH, "transactions")
+pgn_metadata_store = SQLiteStore(DB_PATH, "pgn_metadata")
+# Secondary indexes, SQLite-backed like the primary store so a PGN
+# recorded on one worker is immediately visible to the rest:
+# wallet -> list of pgn_ids, so listing a wallet's PGNs is O(1) instead
+# of a scan over every PGN ever created
+wallet_pgn_store = SQLiteStore(DB_PATH, "wallet_pgns")
+# pgn_hash -> pgn_id, so existence checks are one indexed lookup
+pgn_hash_store = SQLiteStore(DB_PATH, "pgn_hashes")
+# One compiled alternation finds all validation markers in a single
+# pass over the bytes instead of three separate substring scans
+_PGN_MARKER_RE = re.compile(rb'\[Event |\[Result |DataBitLength')
+_PGN_MARKER_BITS = {b'[Event ': 0b001, b'[Result ': 0b010,
+                    b'DataBitLength': 0b100}
+# Marker-scan results per file hash: the same upload validated twice
+# costs one hash plus a dict hit the second time. Per-process on
+# purpose: entries are a pure function of the content hash, so workers
+# can never disagree about them
+_validate_cache = {}
+
+# One-time backfill for databases created before the index tables
+if len(pgn_hash_store) < len(pgn_metadata_store):
+    for _pgn_id, _metadata in pgn_metadata_store.items():
+        _wallet_pgns = wallet_pgn_store.get(_metadata["wallet_address"], [])
+        if _pgn_id not in _wallet_pgns:
+            _wallet_pgns.append(_pgn_id)
+            wallet_pgn_store[_metadata["wallet_address"]] = _wallet_pgns
+        pgn_hash_store[_metadata["pgn_hash"]] = _pgn_id
+
+def purge_expired_transactions():
+    """Drop unconfirmed transactions past their 15-minute expiry so the
+    store stays bounded instead of accumulating every transaction ever
+    initiated. Confirmed payments are kept: the expiry window bounds how
+    long a payment may stay pending, not how long a paid transaction
+    stays usable"""
+    now = time.time()
+    expired = [tx_id for tx_id, tx in transaction_store.items()
+               if tx["expires_at"] < now and tx["status"] != "confirmed"]
+    for tx_id in expired:
+        del transaction_store[tx_id]
+
+# PGN header fields with their form keys, precomputed once instead of
+# rebuilding the list and lowercasing each field per encode request
+PGN_HEADER_FIELDS = (
+    ("Event", "pgn_event"), ("Site", "pgn_site"), ("Date", "pgn_date"),
+    ("Round", "pgn_round"), ("White", "pgn_white"), ("Black", "pgn_black"),
+    ("WhiteElo", "pgn_whiteelo"), ("BlackElo", "pgn_blackelo"),
+    ("Result", "pgn_result"), ("ECO", "pgn_eco")
+)
+
+# Worker pool for the CPU-bound stego pipeline: requests submit encode/
+# decode jobs and poll for the result, so HTTP workers only do I/O and
+# independent jobs run in parallel across cores. Job bookkeeping lives
+# in SQLite so a status poll or result fetch can land on any gunicorn
+# worker, not just the one that accepted the upload: each worker's pool
+# runs the jobs it accepted and publishes the outcome to the shared row
+# via a completion callback
+executor = ProcessPoolExecutor(max_workers=os.cpu_count())
+job_store = SQLiteStore(DB_PATH, "jobs")
+# Jobs whose result is never fetched are dropped after this long, so
+# the store and the per-job files stay bounded
+JOB_TTL_SECONDS = 3600
+
+def record_job_outcome(job_id):
+    """Build the completion callback that publishes a job's outcome"""
+    def callback(future):
+        job = job_store.get(job_id)
+        if job is None:
+            return
+        error = future.exception()
+        if error is not None:
+            job["status"] = "failed"
+            job["error"] = str(error)
+        else:
+            job["status"] = "done"
+        job_store[job_id] = job
+    return callback
+
+def purge_stale_jobs():
+    """Drop job records past their TTL, deleting any per-job files that
+    were never cleaned up by a result fetch"""
+    cutoff = time.time() - JOB_TTL_SECONDS
+    for job_id, job in list(job_store.items()):
+        if job["created_at"] >= cutoff:
+            continue
+        if job["kind"] == "decode":
+            cleanup_decode_job(job)
+        else:
+            # Untimed encode outputs live in the content-addressed
+            # cache and stay; the uploaded input, and the per-job
+            # output of a timed encode, go with the row
+            try:
+                os.unlink(job["input_path"])
+            except OSError:
+                pass
+            if job.get("self_destruct_timer"):
+                try:
+                    os.unlink(job["output_path"])
+                except OSError:
+                    pass
+        try:
+            del job_store[job_id]
+        except KeyError:
+            pass
+def encode_to_cache(input_path, output_path, self_destruct_timer, custom_headers):
+    """Encode into a temp name and publish it into the cache path with
+    an atomic rename, so the cache-hit existence check in handle_encode
+    can never observe a half-written PGN from a concurrent request"""
+    tmp_path = f"{output_path}.{uuid.uuid4().hex}.tmp"
+    try:
+        encode(input_path, tmp_path, self_destruct_timer, custom_headers)
+        os.replace(tmp_path, output_path)
+    finally:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
 
-# In-memory storage for demo (replace with proper database in production)
-transaction_store = {}
-pgn_metadata_store = {}
 def allowed_file(filename):
-    return '.' in filename and \
-           filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+    return _ALLOWED_RE.search(filename) is not None
 
+@functools.lru_cache(maxsize=1024)
 def get_safe_filename(filename):
-    filename = os.path.basename(filename)
+    # secure_filename already strips path components, so the basename
+    # pre-pass was redundant; repeat uploads of the same name skip the
+    # regex work entirely via the cache
     return secure_filename(filename)
 
 def generate_transaction_id():
     """Generate a unique transaction ID"""
-    return str(uuid.uuid4())
+    # token_hex pulls straight from the CSPRNG without uuid's string
+    # formatting; same 128 bits of entropy in the hot request path
+    return secrets.token_hex(16)
 
 def calculate_file_hash(file_data):
     """Calculate SHA-256 hash of file data"""
     return hashlib.sha256(file_data).hexdigest()
 
+def calculate_file_hash_path(path):
+    """Calculate SHA-256 hash of a file on disk without loading it"""
+    with open(path, 'rb') as f:
+        return hashlib.file_digest(f, 'sha256').hexdigest()
+
+def request_too_large():
+    """True when the declared Content-Length exceeds the upload cap,
+    so handlers can refuse before any body bytes are read or spooled"""
+    content_length = request.content_length
+    return (content_length is not None and
+            content_length > app.config['MAX_CONTENT_LENGTH'])
+
 def validate_wallet_signature(wallet_address, signature, message):
     """Validate wallet signature (placeholder - implement actual validation)"""
     # In production, implement proper signature validation
@@ -119,8 +310,13 @@ def initiate_payment():
                 "message": "Operation must be either 'encode' or 'decode'"
             }), 400
         
+        # Sweep out transactions that have passed their expiry before
+        # adding a new one, keeping the store bounded
+        purge_expired_transactions()
+
         # Generate transaction ID
         transaction_id = generate_transaction_id()
+        created_at = time.time()
         
         # X402 micropayment amounts (in wei)
         payment_amounts = {
@@ -138,8 +334,10 @@ def initiate_payment():
             "amount": payment_amount,
             "amount_eth": float(int(payment_amount) / 1e18),  # Convert to ETH for display
             "status": "pending",
-            "created_at": datetime.now().isoformat(),
-            "expires_at": (datetime.now() + timedelta(minutes=15)).isoformat(),
+            # Epoch floats: comparisons are plain float compares and no
+            # datetime objects or ISO strings are built per request
+            "created_at": created_at,
+            "expires_at": created_at + 900,
             "x402_protocol": "v1.0",
             "network": "ethereum"
         }
@@ -185,14 +383,15 @@ def verify_payment():
         transaction = transaction_store[transaction_id]
         
         # Check if transaction hasn't expired
-        expires_at = datetime.fromisoformat(transaction["expires_at"])
-        if datetime.now() > expires_at:
+        if time.time() > transaction["expires_at"]:
             return jsonify({"error": "Transaction expired"}), 400
-        
-        # Update transaction status
-        transaction_store[transaction_id]["status"] = "confirmed"
-        transaction_store[transaction_id]["tx_hash"] = tx_hash
-        transaction_store[transaction_id]["confirmed_at"] = datetime.now().isoformat()
+
+        # Update transaction status (write the record back so the
+        # change reaches the shared database, not just this copy)
+        transaction["status"] = "confirmed"
+        transaction["tx_hash"] = tx_hash
+        transaction["confirmed_at"] = time.time()
+        transaction_store[transaction_id] = transaction
         
         return jsonify({
             "success": True,
@@ -236,6 +435,8 @@ def preview():
     else:
         # Handle POST request for file preview
         try:
+            if request_too_large():
+                return jsonify({"error": "File is too large. Maximum file size is 16 MB"}), 413
             if 'file' not in request.files:
                 return jsonify({"error": "No file part"}), 400
             
@@ -247,23 +448,31 @@ def preview():
             if not file_type or file_type not in ['text', 'image']:
                 return jsonify({"error": "Invalid file type"}), 400
             
-            # Read file data
-            file_data = file.read()
-            if len(file_data) == 0:
+            # The preview only needs the size and a 1 KiB sample, so read
+            # the sample from the stream instead of loading the whole upload
+            stream = file.stream
+            stream.seek(0, os.SEEK_END)
+            file_size = stream.tell()
+            if file_size == 0:
                 return jsonify({"error": "File is empty"}), 400
-                
-            # For preview, we'll return some basic info and a sample of the binary data
+            stream.seek(0)
+            sample = stream.read(1024)
+
             file_info = {
                 "filename": file.filename,
-                "size": len(file_data),
+                "size": file_size,
                 "file_type": file_type,
-                "bit_count": len(file_data) * 8,
+                "bit_count": file_size * 8,
                 # Send back a base64 sample for the UI to show
-                "data_sample": b64encode(file_data[:1024] if len(file_data) > 1024 else file_data).decode('utf-8')
+                "data_sample": b64encode(sample).decode('utf-8')
             }
             
             return jsonify({"success": True, "file_info": file_info})
-            
+
+        except HTTPException:
+            # Let werkzeug errors (e.g. 413 from MAX_CONTENT_LENGTH) keep
+            # their status instead of collapsing into a 500
+            raise
         except Exception as e:
             app.logger.error(f"Preview encoding error: {str(e)}", exc_info=True)
             return jsonify({"error": f"Error processing file: {str(e)}"}), 500
@@ -272,7 +481,11 @@ def preview():
 def handle_encode():
     try:
         app.logger.debug("Starting encode request")
-        
+
+        # Refuse oversized bodies from the declared Content-Length alone
+        if request_too_large():
+            return jsonify({"error": "File is too large. Maximum file size is 16 MB"}), 413
+
         # MANDATORY: Check wallet connection
         wallet_address = request.form.get("wallet_address")
         if not wallet_address:
@@ -326,22 +539,21 @@ def handle_encode():
             return jsonify({"error": "No file part"}), 400
         
         file = request.files['file']
-        app.logger.debug(f"Received file: {file.filename}")
+        app.logger.debug("Received file: %s", file.filename)
         
         if file.filename == '':
             app.logger.error("No selected file")
             return jsonify({"error": "No selected file"}), 400
         
         file_type = request.form.get("file_type")
-        wallet_address = request.form.get("wallet_address")
-        app.logger.debug(f"File type: {file_type}, Wallet: {wallet_address}")
+        app.logger.debug("File type: %s, Wallet: %s", file_type, wallet_address)
         
         # Get self-destruct timer from form (in seconds)
         self_destruct_timer = request.form.get("self_destruct_timer")
         if self_destruct_timer:
             try:
                 self_destruct_timer = int(self_destruct_timer)
-                app.logger.debug(f"Self-destruct timer set to: {self_destruct_timer} seconds")
+                app.logger.debug("Self-destruct timer set to: %s seconds", self_destruct_timer)
             except ValueError:
                 app.logger.error(f"Invalid self-destruct timer value: {self_destruct_timer}")
                 return jsonify({"error": "Invalid self-destruct timer value"}), 400
@@ -349,18 +561,13 @@ def handle_encode():
             self_destruct_timer = None
             app.logger.debug("No self-destruct timer provided")
         
-        # Get custom PGN headers from form
-        custom_headers = {}
-        pgn_header_fields = [
-            "Event", "Site", "Date", "Round", "White", "Black", 
-            "WhiteElo", "BlackElo", "Result", "ECO"
-        ]
-        
-        for field in pgn_header_fields:
-            value = request.form.get(f"pgn_{field.lower()}")
-            if value:
-                custom_headers[field] = value
-                app.logger.debug(f"Custom header {field}: {value}")
+        # Get custom PGN headers from form: one pass over the
+        # precomputed (field, form key) table
+        form_get = request.form.get
+        custom_headers = {field: value for field, form_key in PGN_HEADER_FIELDS
+                          if (value := form_get(form_key))}
+        if custom_headers:
+            app.logger.debug("Custom headers: %s", custom_headers)
         
         if not file_type or file_type not in ['text', 'image']:
             app.logger.error(f"Invalid file type: {file_type}")
@@ -368,74 +575,85 @@ def handle_encode():
         
         if file and allowed_file(file.filename):
             filename = get_safe_filename(file.filename)
-            app.logger.debug(f"Safe filename: {filename}")
+            app.logger.debug("Safe filename: %s", filename)
 
-            input_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            app.logger.debug(f"Saving to: {input_path}")
-            file.save(input_path)
+            # Unique name per request so concurrent uploads of the same
+            # filename cannot clobber each other
+            input_path = UPLOAD_DIR / f"{uuid.uuid4().hex}_{filename}"
+            app.logger.debug("Saving to: %s", input_path)
 
-            output_path = os.path.join(app.config['OUTPUT_FOLDER'], "encoded_output.pgn")
-            app.logger.debug(f"Output path: {output_path}")
+            # Content-addressed cache: the same file encoded with the
+            # same headers reuses the previous output instead of
+            # re-running the stego pipeline. The cache-key digest is fed
+            # while the upload streams to disk, so the file is only read
+            # once and never materialized in memory.
+            digest = hashlib.blake2b(digest_size=16)
+            stream = file.stream
+            with open(input_path, 'wb') as out:
+                while chunk := stream.read(1 << 20):
+                    out.write(chunk)
+                    digest.update(chunk)
 
-            try:
-                # Pass the self-destruct timer and custom headers to the encode function
-                encode(input_path, output_path, self_destruct_timer, custom_headers if custom_headers else None)
-                app.logger.debug("Encoding completed")
-                
-                # Store PGN metadata for blockchain tracking
-                with open(output_path, 'rb') as f:
-                    pgn_data = f.read()
-                    pgn_hash = calculate_file_hash(pgn_data)
-                
-                # Generate unique PGN ID
-                pgn_id = generate_transaction_id()
-                
-                # Store metadata
-                pgn_metadata_store[pgn_id] = {
-                    "pgn_hash": pgn_hash,
-                    "original_filename": filename,
-                    "wallet_address": wallet_address,
-                    "transaction_id": transaction_id,
-                    "created_at": datetime.now().isoformat(),
-                    "file_type": file_type,
-                    "self_destruct_timer": self_destruct_timer,
-                    "custom_headers": custom_headers
-                }
-                
-                # Store PGN file in blockchain storage
-                blockchain_path = os.path.join(app.config['STORAGE_FOLDER'], f"{pgn_id}.pgn")
-                with open(blockchain_path, 'wb') as f:
-                    f.write(pgn_data)
-                
-            except Exception as e:
-                app.logger.error(f"Encoding failed: {str(e)}", exc_info=True)
-                return jsonify({"error": f"Encoding failed: {str(e)}"}), 500
-
-            if not os.path.exists(output_path):
-                app.logger.error("Output file was not created")
-                return jsonify({"error": "Output file was not created"}), 500
-
-            app.logger.debug("Sending encoded file")
-            
-            # Return both file and metadata
-            response_data = {
-                "success": True,
-                "pgn_id": pgn_id,
-                "pgn_hash": pgn_hash,
-                "message": "File encoded successfully"
+            # Timed encodes bake ExpiryTime = now + timer into the PGN,
+            # so their output is wall-clock-dependent: a cache hit after
+            # the first copy's expiry would deliver an already-dead file
+            # while reporting success. They get a per-job output path
+            # and never touch the cache.
+            if self_destruct_timer:
+                output_path = OUTPUT_DIR / f"encoded_{uuid.uuid4().hex}.pgn"
+                cache_hit = False
+            else:
+                digest.update(json.dumps(custom_headers, sort_keys=True).encode())
+                cache_key = digest.hexdigest()
+                output_path = ENCODE_CACHE_DIR / f"{cache_key}.pgn"
+                cache_hit = os.path.exists(output_path)
+            app.logger.debug("Output path: %s", output_path)
+
+            # Submit the CPU-bound pipeline to the worker pool; the client
+            # polls the status URL and fetches the result when done
+            purge_stale_jobs()
+            job_id = generate_transaction_id()
+            job = {
+                "kind": "encode",
+                "status": "running",
+                "created_at": time.time(),
+                "input_path": str(input_path),
+                "output_path": str(output_path),
+                "original_filename": filename,
+                "wallet_address": wallet_address,
+                "transaction_id": transaction_id,
+                "file_type": file_type,
+                "self_destruct_timer": self_destruct_timer,
+                "custom_headers": custom_headers,
+                "pgn_id": None
             }
-            
-            # For API calls (from React frontend), return JSON with download link
-            if request.path.startswith('/api/'):
-                response_data["download_url"] = f"/api/download/{pgn_id}"
-                return jsonify(response_data)
+            if cache_hit:
+                app.logger.debug("Encode cache hit: %s", cache_key)
+                job["status"] = "done"
+                job_store[job_id] = job
             else:
-                # For direct form uploads, return file directly
-                return send_file(output_path, as_attachment=True, download_name="encoded_output.pgn")
-        
+                # Store the row before submitting so the completion
+                # callback always finds it
+                job_store[job_id] = job
+                future = executor.submit(encode_to_cache, input_path, output_path,
+                                         self_destruct_timer,
+                                         custom_headers if custom_headers else None)
+                future.add_done_callback(record_job_outcome(job_id))
+            app.logger.debug("Encode job submitted: %s", job_id)
+
+            return jsonify({
+                "success": True,
+                "job_id": job_id,
+                "status_url": f"/api/encode/status/{job_id}",
+                "result_url": f"/api/encode/result/{job_id}",
+                "message": "Encoding started"
+            }), 202
+
         app.logger.error("File type not allowed")
         return jsonify({"error": "File type not allowed"}), 400
 
+    except HTTPException:
+        raise
     except Exception as e:
         app.logger.error(f"Unexpected error: {str(e)}", exc_info=True)
         return jsonify({"error": f"Unexpected error: {str(e)}"}), 500
@@ -444,7 +662,11 @@ def handle_encode():
 def handle_decode():
     try:
         app.logger.debug("Starting decode request")
-        
+
+        # Refuse oversized bodies from the declared Content-Length alone
+        if request_too_large():
+            return jsonify({"error": "File is too large. Maximum file size is 16 MB"}), 413
+
         # MANDATORY: Check wallet connection
         wallet_address = request.form.get("wallet_address")
         if not wallet_address:
@@ -498,15 +720,14 @@ def handle_decode():
             return jsonify({"error": "No file part"}), 400
         
         file = request.files['file']
-        app.logger.debug(f"Received file: {file.filename}")
+        app.logger.debug("Received file: %s", file.filename)
 
         if file.filename == '':
             app.logger.error("No selected file")
             return jsonify({"error": "No selected file"}), 400
 
         file_type = request.form.get("file_type")
-        wallet_address = request.form.get("wallet_address")
-        app.logger.debug(f"File type: {file_type}, Wallet: {wallet_address}")
+        app.logger.debug("File type: %s, Wallet: %s", file_type, wallet_address)
         
         if not file_type or file_type not in ['text', 'image']:
             app.logger.error(f"Invalid file type: {file_type}")
@@ -514,38 +735,179 @@ def handle_decode():
 
         if file and allowed_file(file.filename):
             filename = get_safe_filename(file.filename)
-            app.logger.debug(f"Safe filename: {filename}")
+            app.logger.debug("Safe filename: %s", filename)
             
-            input_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            app.logger.debug(f"Saving to: {input_path}")
-            file.save(input_path)
+            # Unique name per request so concurrent uploads of the same
+            # filename cannot clobber each other
+            input_path = UPLOAD_DIR / f"{uuid.uuid4().hex}_{filename}"
+            app.logger.debug("Saving to: %s", input_path)
+            # Stream the upload to disk in 1 MiB chunks
+            file.save(input_path, buffer_size=1 << 20)
 
             output_extension = "txt" if file_type == "text" else "png"
-            output_path = os.path.join(app.config['OUTPUT_FOLDER'], f"decoded_output.{output_extension}")
-            app.logger.debug(f"Output path: {output_path}")
-            
-            try:
-                decode(input_path, output_path)
-                app.logger.debug("Decoding completed")
-            except Exception as e:
-                app.logger.error(f"Decoding failed: {str(e)}", exc_info=True)
-                return jsonify({"error": f"Decoding failed: {str(e)}"}), 500
+            output_path = OUTPUT_DIR / f"decoded_{uuid.uuid4().hex}.{output_extension}"
+            app.logger.debug("Output path: %s", output_path)
             
-            if not os.path.exists(output_path):
-                app.logger.error("Output file was not created")
-                return jsonify({"error": "Output file was not created"}), 500
-                
-            app.logger.debug("Sending decoded file")
-            return send_file(output_path, as_attachment=True, 
-                             download_name=f"decoded_output.{output_extension}")
-        
+            # Submit to the worker pool and hand back polling URLs
+            purge_stale_jobs()
+            job_id = generate_transaction_id()
+            job_store[job_id] = {
+                "kind": "decode",
+                "status": "running",
+                "created_at": time.time(),
+                "input_path": str(input_path),
+                "output_path": str(output_path),
+                "output_extension": output_extension
+            }
+            future = executor.submit(decode, input_path, output_path)
+            future.add_done_callback(record_job_outcome(job_id))
+            app.logger.debug("Decode job submitted: %s", job_id)
+
+            return jsonify({
+                "success": True,
+                "job_id": job_id,
+                "status_url": f"/api/decode/status/{job_id}",
+                "result_url": f"/api/decode/result/{job_id}",
+                "message": "Decoding started"
+            }), 202
+
         app.logger.error("File type not allowed")
         return jsonify({"error": "File type not allowed"}), 400
 
+    except HTTPException:
+        raise
     except Exception as e:
         app.logger.error(f"Unexpected error: {str(e)}", exc_info=True)
         return jsonify({"error": f"Unexpected error: {str(e)}"}), 500
         
+def cleanup_decode_job(job):
+    """Delete a finished decode job's input and output files"""
+    for path_key in ("input_path", "output_path"):
+        try:
+            os.unlink(job[path_key])
+        except OSError:
+            pass
+
+def job_status(kind, job_id):
+    """Report whether a submitted encode/decode job has finished"""
+    job = job_store.get(job_id)
+    if job is None or job["kind"] != kind:
+        return jsonify({"error": "Job not found"}), 404
+    if job["status"] == "failed":
+        return jsonify({"success": True, "status": "failed",
+                        "error": job.get("error", "")})
+    return jsonify({"success": True, "status": job["status"]})
+
+@app.route("/api/encode/status/<job_id>", methods=["GET"])
+def encode_status(job_id):
+    return job_status("encode", job_id)
+
+@app.route("/api/decode/status/<job_id>", methods=["GET"])
+def decode_status(job_id):
+    return job_status("decode", job_id)
+
+@app.route("/api/encode/result/<job_id>", methods=["GET"])
+def encode_result(job_id):
+    """Fetch the encoded PGN once the background job has finished"""
+    try:
+        job = job_store.get(job_id)
+        if job is None or job["kind"] != "encode":
+            return jsonify({"error": "Job not found"}), 404
+        if job["status"] == "running":
+            return jsonify({"error": "Job still running", "status": "running"}), 202
+        if job["status"] == "failed":
+            app.logger.error(f"Encoding failed: {job.get('error', '')}")
+            return jsonify({"error": f"Encoding failed: {job.get('error', '')}"}), 500
+
+        output_path = job["output_path"]
+        if not os.path.exists(output_path):
+            app.logger.error("Output file was not created")
+            return jsonify({"error": "Output file was not created"}), 500
+
+        # Record blockchain metadata once, on first successful fetch
+        if job["pgn_id"] is None:
+            # Stream-hash the PGN rather than pulling it into memory
+            sha256 = hashlib.sha256()
+            with open(output_path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    sha256.update(chunk)
+            pgn_hash = sha256.hexdigest()
+            pgn_id = generate_transaction_id()
+            pgn_metadata_store[pgn_id] = {
+                "pgn_hash": pgn_hash,
+                "original_filename": job["original_filename"],
+                "wallet_address": job["wallet_address"],
+                "transaction_id": job["transaction_id"],
+                "created_at": datetime.now().isoformat(),
+                "file_type": job["file_type"],
+                "self_destruct_timer": job["self_destruct_timer"],
+                "custom_headers": job["custom_headers"]
+            }
+            blockchain_path = STORAGE_DIR / f"{pgn_id}.pgn"
+            # Hard-link the cached output into blockchain storage instead
+            # of rewriting the bytes; fall back to a copy if the two
+            # directories ever land on different filesystems
+            try:
+                os.link(output_path, blockchain_path)
+            except OSError:
+                shutil.copyfile(output_path, blockchain_path)
+            wallet_pgns = wallet_pgn_store.get(job["wallet_address"], [])
+            wallet_pgns.append(pgn_id)
+            wallet_pgn_store[job["wallet_address"]] = wallet_pgns
+            pgn_hash_store[pgn_hash] = pgn_id
+            job["pgn_id"] = pgn_id
+            job["pgn_hash"] = pgn_hash
+            job_store[job_id] = job
+            # The upload is no longer needed once the PGN is recorded
+            try:
+                os.unlink(job["input_path"])
+            except OSError:
+                pass
+
+        app.logger.debug("Sending encoded file")
+        return send_file(output_path, as_attachment=True,
+                         download_name="encoded_output.pgn")
+
+    except Exception as e:
+        app.logger.error(f"Unexpected error: {str(e)}", exc_info=True)
+        return jsonify({"error": f"Unexpected error: {str(e)}"}), 500
+
+@app.route("/api/decode/result/<job_id>", methods=["GET"])
+def decode_result(job_id):
+    """Fetch the decoded file once the background job has finished"""
+    try:
+        job = job_store.get(job_id)
+        if job is None or job["kind"] != "decode":
+            return jsonify({"error": "Job not found"}), 404
+        if job["status"] == "running":
+            return jsonify({"error": "Job still running", "status": "running"}), 202
+        if job["status"] == "failed":
+            app.logger.error(f"Decoding failed: {job.get('error', '')}")
+            return jsonify({"error": f"Decoding failed: {job.get('error', '')}"}), 500
+
+        output_path = job["output_path"]
+        if not os.path.exists(output_path):
+            app.logger.error("Output file was not created")
+            return jsonify({"error": "Output file was not created"}), 500
+
+        app.logger.debug("Sending decoded file")
+        # Buffer the (size-capped) result, remove the per-job files and
+        # evict the job row right away: decode results are one-shot, so
+        # a repeat fetch gets a clean 404 instead of a missing-file 500
+        with open(output_path, 'rb') as f:
+            payload = BytesIO(f.read())
+        cleanup_decode_job(job)
+        try:
+            del job_store[job_id]
+        except KeyError:
+            pass
+        return send_file(payload, as_attachment=True,
+                         download_name=f"decoded_output.{job['output_extension']}")
+
+    except Exception as e:
+        app.logger.error(f"Unexpected error: {str(e)}", exc_info=True)
+        return jsonify({"error": f"Unexpected error: {str(e)}"}), 500
+
 # Additional API endpoints for decentralized features
 
 @app.route("/api/download/<pgn_id>", methods=["GET"])
@@ -555,14 +917,37 @@ def download_pgn(pgn_id):
         if pgn_id not in pgn_metadata_store:
             return jsonify({"error": "PGN not found"}), 404
         
-        blockchain_path = os.path.join(app.config['STORAGE_FOLDER'], f"{pgn_id}.pgn")
+        blockchain_path = STORAGE_DIR / f"{pgn_id}.pgn"
         if not os.path.exists(blockchain_path):
             return jsonify({"error": "PGN file not found"}), 404
         
         metadata = pgn_metadata_store[pgn_id]
-        return send_file(blockchain_path, as_attachment=True, 
-                        download_name=f"encoded_{metadata['original_filename']}.pgn")
-        
+        download_name = f"encoded_{metadata['original_filename']}.pgn"
+
+        # Stored PGNs are immutable and content-addressed by pgn_hash,
+        # so repeat clients can be answered with a bodyless 304
+        etag = metadata['pgn_hash']
+        if request.if_none_match.contains(etag):
+            return Response(status=304)
+
+        # Behind nginx, hand delivery off to an internal location so the
+        # proxy streams the file with sendfile(2) and the worker returns
+        # immediately; Apache's X-Sendfile is covered by USE_X_SENDFILE
+        if X_ACCEL_REDIRECT_PREFIX:
+            response = Response(mimetype='application/x-chess-pgn')
+            response.headers['X-Accel-Redirect'] = (
+                f"{X_ACCEL_REDIRECT_PREFIX}/{pgn_id}.pgn")
+            response.headers['Content-Disposition'] = (
+                f'attachment; filename="{download_name}"')
+        else:
+            response = send_file(blockchain_path, as_attachment=True,
+                                 download_name=download_name)
+        response.set_etag(etag)
+        response.cache_control.no_cache = None  # send_file sets this by default
+        response.cache_control.max_age = 31536000
+        response.cache_control.immutable = True
+        return response
+
     except Exception as e:
         app.logger.error(f"Download error: {str(e)}")
         return jsonify({"error": "Download failed"}), 500
@@ -575,6 +960,13 @@ def get_pgn_metadata(pgn_id):
             return jsonify({"error": "PGN not found"}), 404
         
         metadata = pgn_metadata_store[pgn_id]
+
+        # Metadata for a stored PGN never changes; reuse its hash as the
+        # ETag so repeat fetches cost no serialization at all
+        etag = metadata["pgn_hash"]
+        if request.if_none_match.contains(etag):
+            return Response(status=304)
+
         # Remove sensitive information
         public_metadata = {
             "pgn_id": pgn_id,
@@ -582,8 +974,12 @@ def get_pgn_metadata(pgn_id):
             "created_at": metadata["created_at"],
             "file_type": metadata["file_type"]
         }
-        
-        return jsonify({"success": True, "metadata": public_metadata})
+
+        response = jsonify({"success": True, "metadata": public_metadata})
+        response.set_etag(etag)
+        response.cache_control.max_age = 31536000
+        response.cache_control.immutable = True
+        return response
         
     except Exception as e:
         app.logger.error(f"Metadata retrieval error: {str(e)}")
@@ -598,15 +994,15 @@ def list_user_pgns():
             return jsonify({"error": "Wallet address required"}), 400
         
         user_pgns = []
-        for pgn_id, metadata in pgn_metadata_store.items():
-            if metadata.get("wallet_address") == wallet_address:
-                user_pgns.append({
-                    "pgn_id": pgn_id,
-                    "pgn_hash": metadata["pgn_hash"],
-                    "original_filename": metadata["original_filename"],
-                    "created_at": metadata["created_at"],
-                    "file_type": metadata["file_type"]
-                })
+        for pgn_id in wallet_pgn_store.get(wallet_address, ()):
+            metadata = pgn_metadata_store[pgn_id]
+            user_pgns.append({
+                "pgn_id": pgn_id,
+                "pgn_hash": metadata["pgn_hash"],
+                "original_filename": metadata["original_filename"],
+                "created_at": metadata["created_at"],
+                "file_type": metadata["file_type"]
+            })
         
         return jsonify({"success": True, "pgns": user_pgns})
         
@@ -625,16 +1021,33 @@ def validate_pgn():
         if file.filename == '':
             return jsonify({"error": "No selected file"}), 400
         
-        # Read and validate PGN
-        pgn_content = file.read().decode('utf-8')
-        file_hash = calculate_file_hash(pgn_content.encode('utf-8'))
-        
-        # Basic PGN validation (you can enhance this)
-        is_valid_pgn = '[Event ' in pgn_content and '[Result ' in pgn_content
-        has_hidden_data = 'DataBitLength' in pgn_content
-        
+        # Hash the spooled upload in a streaming pass, then scan the raw
+        # bytes — no UTF-8 decode is needed just to look for markers
+        stream = file.stream
+        file_hash = hashlib.file_digest(stream, 'sha256').hexdigest()
+
+        # The marker scan is pure in the content, so repeat uploads of
+        # the same file are answered from the hash-keyed cache
+        cached = _validate_cache.get(file_hash)
+        if cached is None:
+            stream.seek(0)
+            pgn_bytes = stream.read()
+
+            # Basic PGN validation (you can enhance this): one regex
+            # pass collects all three markers into a bit mask
+            mask = 0
+            for match in _PGN_MARKER_RE.finditer(pgn_bytes):
+                mask |= _PGN_MARKER_BITS[match.group()]
+                if mask == 0b111:
+                    break
+            is_valid_pgn = (mask & 0b011) == 0b011
+            has_hidden_data = bool(mask & 0b100)
+            _validate_cache[file_hash] = (is_valid_pgn, has_hidden_data)
+        else:
+            is_valid_pgn, has_hidden_data = cached
+
         # Check if this PGN exists in our store
-        pgn_exists = any(metadata["pgn_hash"] == file_hash for metadata in pgn_metadata_store.values())
+        pgn_exists = file_hash in pgn_hash_store
         
         return jsonify({
             "success": True,
@@ -643,7 +1056,9 @@ def validate_pgn():
             "file_hash": file_hash,
             "pgn_exists_in_store": pgn_exists
         })
-        
+
+    except HTTPException:
+        raise
     except Exception as e:
         app.logger.error(f"PGN validation error: {str(e)}")
         return jsonify({"error": "PGN validation failed"}), 500
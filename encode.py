@@ -1,203 +1,216 @@
 import os
 import random
 import logging
+from itertools import islice
 import time
 from time import time as current_time, strftime
-from math import log2, floor
-from chess import pgn, Board
-from typing import List, Optional, Dict
+from chess import Board
+from moveperm import pick_move
+from typing import Optional, Dict
 
-logging.basicConfig(level=logging.DEBUG)
+# Logging configuration belongs to the application embedding this
+# module; claiming the root logger here forced DEBUG onto every
+# importer and made the isEnabledFor guards below always-true
 logger = logging.getLogger(__name__)
-def read_input_file(file_path: str) -> List[int]:
+def read_input_file(file_path: str) -> bytes:
     if not os.path.exists(file_path):
-        logger.error(f"Input file does not exist: {file_path}")
+        logger.error("Input file does not exist: %s", file_path)
         raise ValueError("Input file does not exist")
+    # Keep the raw bytes object: boxing every byte into a list of ints
+    # costs ~28 bytes of PyObject per payload byte, and bytes already
+    # indexes and slices the way the bit extractor needs
     with open(file_path, "rb") as input_file:
-        file_bytes = list(input_file.read())
+        file_bytes = input_file.read()
     if not file_bytes:
         logger.error("Input file is empty")
         raise ValueError("Input file is empty")
     return file_bytes
-def extract_bits(file_bytes: List[int], bit_index: int, bits_to_extract: int) -> str:
-    """Extract bits from file bytes starting at bit_index"""
-    total_bits = len(file_bytes) * 8
-    if bit_index >= total_bits:
-        return '0' * bits_to_extract
-    
-    # Limit bits_to_extract to available bits
-    available_bits = total_bits - bit_index
-    bits_to_extract = min(bits_to_extract, available_bits)
-    
-    result_bits = ""
-    current_bit_index = bit_index
-    
-    for _ in range(bits_to_extract):
-        byte_index = current_bit_index // 8
-        bit_offset = current_bit_index % 8
-        
-        if byte_index < len(file_bytes):
-            # Extract bit from MSB to LSB (left to right)
-            bit_value = (file_bytes[byte_index] >> (7 - bit_offset)) & 1
-            result_bits += str(bit_value)
-        else:
-            result_bits += '0'
-        
-        current_bit_index += 1
-    
-    return result_bits
-def create_game_record(board: Board, seed: int, expiry_time: Optional[int] = None,
+def create_game_record(board: Board, seed: int, base_headers: Dict[str, str],
                        custom_headers: Optional[Dict[str, str]] = None, data_bit_length: Optional[int] = None) -> str:
-    game = pgn.Game()
-    game.headers["Seed"] = str(seed)
-    default_headers = {
-        "Event": "Encoded Game",
-        "Date": strftime("%Y.%m.%d"),
-        "White": "Player1",
-        "Black": "Player2",
-        "Result": "*"  
-    }
+    headers = base_headers
     if custom_headers:
+        headers = dict(base_headers)
         for key, value in custom_headers.items():
             if value:  
-                default_headers[key] = value
-    for key, value in default_headers.items():
-        game.headers[key] = value
-    if expiry_time is not None:
-        logger.debug(f"Setting ExpiryTime header to {expiry_time}")
-        game.headers["ExpiryTime"] = str(expiry_time)
-        readable_time = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(expiry_time))
-        game.headers["ExpiryTimeReadable"] = readable_time
+                headers[key] = value
+        # The expiry fields are authoritative: a custom header must
+        # never mask the real expiry stamp
+        for key in ("ExpiryTime", "ExpiryTimeReadable"):
+            if key in base_headers:
+                headers[key] = base_headers[key]
     else:
-        logger.debug("No expiry time provided, not setting ExpiryTime header")
+        headers = dict(base_headers)
+    headers["Seed"] = str(seed)
+    # Codec version tag: decode selects the matching move-permutation
+    # replay from this, and files without it fall back to the original
+    # full-shuffle codec
+    headers["StegoVersion"] = "2"
     if data_bit_length is not None:
-        game.headers["DataBitLength"] = str(data_bit_length)
-        logger.debug(f"Setting DataBitLength header to {data_bit_length}")
-    game.add_line(board.move_stack)
-    return str(game)
+        headers["DataBitLength"] = str(data_bit_length)
+        logger.debug("Setting DataBitLength header to %s", data_bit_length)
+    # Emit the PGN by hand: a tag block plus one movetext line. Building
+    # a pgn.Game tree allocates a ChildNode per move and then walks the
+    # whole tree again in str(); the output here is deterministic enough
+    # that string assembly gives the same parseable record directly.
+    # Values go out raw, exactly as python-chess's own writer emits
+    # them — its reader takes everything between the outermost quotes
+    tags = "\n".join(
+        f'[{key} "{value}"]' for key, value in headers.items())
+    movetext = Board().variation_san(board.move_stack)
+    result = headers.get("Result", "*")
+    if movetext:
+        return f"{tags}\n\n{movetext} {result}"
+    return f"{tags}\n\n{result}"
 def should_end_game(board: Board) -> bool:
-    return (board.is_game_over() or
-            board.is_insufficient_material() or
-            board.can_claim_draw() or
-            len(board.move_stack) >= 50)
+    # Cheapest checks first: the move-count cap is O(1) and
+    # is_game_over already covers insufficient material, so the
+    # expensive can_claim_draw repetition scan only runs when nothing
+    # cheaper has ended the game
+    return (len(board.move_stack) >= 50 or
+            board.is_game_over() or
+            board.can_claim_draw())
 def encode(file_path: str, output_pgn_path: str, self_destruct_timer: Optional[int] = None,
-           custom_headers: Optional[Dict[str, str]] = None) -> None:
+           custom_headers: Optional[Dict[str, str]] = None) -> str:
     try:
         start_time = current_time()
-        logger.debug(f"Starting encoding of file: {file_path}")
+        logger.debug("Starting encoding of file: %s", file_path)
         file_bytes = read_input_file(file_path)
         file_bits_count = len(file_bytes) * 8
-        logger.debug(f"File size: {len(file_bytes)} bytes ({file_bits_count} bits)")
+        logger.debug("File size: %s bytes (%s bits)", len(file_bytes), file_bits_count)
         expiry_time = None
         if self_destruct_timer is not None and self_destruct_timer > 0:
             expiry_time = int(current_time()) + self_destruct_timer
-            logger.debug(f"Setting expiry time to: {expiry_time} (current time + {self_destruct_timer} seconds)")
+            logger.debug("Setting expiry time to: %s (current time + %s seconds)", expiry_time, self_destruct_timer)
             human_readable = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(expiry_time))
-            logger.debug(f"File will expire at: {human_readable}")
+            logger.debug("File will expire at: %s", human_readable)
         else:
             logger.debug("No self-destruct timer provided, file will not expire")
 
+        # The date and expiry stamps are invariant across games: format
+        # them once here instead of calling strftime per game record
+        base_headers = {
+            "Event": "Encoded Game",
+            "Date": strftime("%Y.%m.%d"),
+            "White": "Player1",
+            "Black": "Player2",
+            "Result": "*"  
+        }
+        if expiry_time is not None:
+            base_headers["ExpiryTime"] = str(expiry_time)
+            base_headers["ExpiryTimeReadable"] = time.strftime(
+                "%Y-%m-%d %H:%M:%S", time.localtime(expiry_time))
+
         output_pgns = []
         file_bit_index = 0
+
+        def emit_game(game_number: int) -> None:
+            # Header assembly and the game-one DataBitLength special
+            # case were repeated verbatim at all three emit sites;
+            # build the record in one place
+            if custom_headers:
+                game_headers = custom_headers.copy()
+                if game_number > 1 and "Round" not in game_headers:
+                    game_headers["Round"] = str(game_number)
+            else:
+                game_headers = {"Round": str(game_number)} if game_number > 1 else None
+            output_pgns.append(create_game_record(
+                chess_board, base_seed, base_headers, game_headers,
+                file_bits_count if game_number == 1 else None))
+
+        # Rolling bit buffer over the payload: refilled seven bytes at a
+        # time, consumed MSB-first with one shift+mask per move instead
+        # of re-deriving byte index and offset for every extraction
+        bit_buf = 0
+        buf_len = 0
+        byte_pos = 0
         chess_board = Board()
-        base_seed = random.randint(1, 1_000_000)
+        # randint(1, 1_000_000) rejection-samples 20-bit draws for a
+        # non-power-of-two range; the seed only needs to be random bits
+        # (the "or 1" keeps it nonzero), so draw them directly
+        base_seed = random.getrandbits(20) or 1
+        # One Mersenne-Twister instance for the whole encode, reseeded
+        # at game boundaries: seeding in place is state-identical to
+        # constructing random.Random(base_seed) but skips a fresh
+        # 2.5 KiB state allocation per game
         move_random = random.Random(base_seed)
-        logger.debug(f"Generated seed: {base_seed}")
+        logger.debug("Generated seed: %s", base_seed)
         game_number = 1
 
         while file_bit_index < file_bits_count:
-            legal_moves = list(chess_board.legal_moves)
-            logger.debug(f"Position has {len(legal_moves)} legal moves")
-            if len(legal_moves) <= 1:
-                if legal_moves:
-                    chess_board.push(legal_moves[0])
+            # Peek at most two moves first: terminal and forced-move
+            # positions are settled without materializing the full move
+            # list, which is only needed when there is a real choice to
+            # encode into
+            first_moves = list(islice(chess_board.generate_legal_moves(), 2))
+            if len(first_moves) <= 1:
+                if first_moves:
+                    chess_board.push(first_moves[0])
                     logger.debug("Pushed forced move")
-                if len(legal_moves) == 0 or chess_board.is_game_over():
+                if len(first_moves) == 0 or chess_board.is_game_over():
                     logger.debug("Creating new game")
-                    if custom_headers:
-                        game_headers = custom_headers.copy()
-                        if game_number > 1 and "Round" not in game_headers:
-                            game_headers["Round"] = str(game_number)
-                    else:
-                        game_headers = {"Round": str(game_number)} if game_number > 1 else None
-                    if game_number == 1:
-                        output_pgns.append(create_game_record(
-                            chess_board, base_seed, expiry_time, game_headers, file_bits_count))
-                    else:
-                        output_pgns.append(create_game_record(
-                            chess_board, base_seed, expiry_time, game_headers))
+                    emit_game(game_number)
                     chess_board.reset()
-                    base_seed = random.randint(1, 1_000_000)
-                    move_random = random.Random(base_seed)
-                    logger.debug(f"New game created with seed: {base_seed}")
+                    base_seed = random.getrandbits(20) or 1
+                    move_random.seed(base_seed)
+                    logger.debug("New game created with seed: %s", base_seed)
                     game_number += 1
                 continue
-            max_bits = floor(log2(len(legal_moves)))
+            legal_moves = list(chess_board.legal_moves)
+            logger.debug("Position has %s legal moves", len(legal_moves))
+            # bit_length is the integer floor(log2) without the float
+            # conversion or math-call overhead
+            max_bits = len(legal_moves).bit_length() - 1
             remaining_bits = file_bits_count - file_bit_index
             bits_to_encode = min(max_bits, remaining_bits)
-            logger.debug(f"Encoding {bits_to_encode} bits in this move")
-            bits = extract_bits(file_bytes, file_bit_index, bits_to_encode)
-            move_index = int(bits, 2)
+            logger.debug("Encoding %s bits in this move", bits_to_encode)
+            if buf_len < bits_to_encode:
+                refill = file_bytes[byte_pos:byte_pos + 7]
+                bit_buf = (bit_buf << (8 * len(refill))) | int.from_bytes(refill, 'big')
+                buf_len += 8 * len(refill)
+                byte_pos += len(refill)
+            buf_len -= bits_to_encode
+            move_index = (bit_buf >> buf_len) & ((1 << bits_to_encode) - 1)
+            bit_buf &= (1 << buf_len) - 1
             if move_index >= len(legal_moves):
-                logger.error(f"Move index {move_index} out of range for {len(legal_moves)} moves")
+                logger.error("Move index %s out of range for %s moves", move_index, len(legal_moves))
                 raise ValueError("Invalid move index calculated")
-            move_random.shuffle(legal_moves)
-            chosen_move = legal_moves[move_index]
+            chosen_move = pick_move(move_random, legal_moves, move_index)
             chess_board.push(chosen_move)
-            logger.debug(f"Pushed move: {chosen_move.uci()}")
+            # Move.__str__ is its UCI form, so serialization only happens
+            # if a handler actually wants the record
+            logger.debug("Pushed move: %s", chosen_move)
             file_bit_index += bits_to_encode
             if should_end_game(chess_board):
                 logger.debug("Ending current game")
-                if custom_headers:
-                    game_headers = custom_headers.copy()
-                    if game_number > 1 and "Round" not in game_headers:
-                        game_headers["Round"] = str(game_number)
-                else:
-                    game_headers = {"Round": str(game_number)} if game_number > 1 else None
-                if game_number == 1:
-                    output_pgns.append(create_game_record(
-                        chess_board, base_seed, expiry_time, game_headers, file_bits_count))
-                else:
-                    output_pgns.append(create_game_record(
-                        chess_board, base_seed, expiry_time, game_headers))
+                emit_game(game_number)
                 if file_bit_index < file_bits_count:
                     chess_board.reset()
-                    base_seed = random.randint(1, 1_000_000)
-                    move_random = random.Random(base_seed)
+                    base_seed = random.getrandbits(20) or 1
+                    move_random.seed(base_seed)
                     logger.debug("Started new game")
                     game_number += 1
         if chess_board.move_stack:
             logger.debug("Saving final game")
-            if custom_headers:
-                game_headers = custom_headers.copy()
-                if game_number > 1 and "Round" not in game_headers:
-                    game_headers["Round"] = str(game_number)
-            else:
-                game_headers = {"Round": str(game_number)} if game_number > 1 else None
-            if game_number == 1:
-                output_pgns.append(create_game_record(
-                    chess_board, base_seed, expiry_time, game_headers, file_bits_count))
-            else:
-                output_pgns.append(create_game_record(
-                    chess_board, base_seed, expiry_time, game_headers))
-        logger.debug(f"Writing output to: {output_pgn_path}")
+            emit_game(game_number)
+        logger.debug("Writing output to: %s", output_pgn_path)
+        pgn_content = "\n\n".join(output_pgns)
         with open(output_pgn_path, "w", encoding='utf-8') as f:
-            f.write("\n\n".join(output_pgns))
-        logger.debug("Verifying PGN headers in output file...")
-        with open(output_pgn_path, "r", encoding='utf-8') as f:
-            pgn_content = f.read()
+            f.write(pgn_content)
+        # Header spot-checks run against the PGN already in memory and
+        # only when debug logging is on, instead of reading the whole
+        # file straight back off disk
+        if logger.isEnabledFor(logging.DEBUG):
             if expiry_time is not None and str(expiry_time) not in pgn_content:
                 logger.error("ExpiryTime header not found in output PGN!")
-            else:
-                logger.debug("ExpiryTime header verified in output PGN")
             if custom_headers:
                 for key, value in custom_headers.items():
                     if value and value not in pgn_content:
-                        logger.warning(f"Custom header {key}: {value} not found in output PGN!")
-                    else:
-                        logger.debug(f"Custom header {key} verified in output PGN")
+                        logger.warning("Custom header %s: %s not found in output PGN!", key, value)
         elapsed_time = current_time() - start_time
-        logger.debug(f"Encoding completed successfully in {elapsed_time:.2f} seconds")
+        logger.debug("Encoding completed successfully in %.2f seconds", elapsed_time)
+        # Hand the PGN back so callers that need it (blockchain_encode)
+        # don't have to re-read the file just written
+        return pgn_content
     except Exception as e:
-        logger.error(f"Encoding error: {str(e)}", exc_info=True)
+        logger.error("Encoding error: %s", e, exc_info=True)
         raise
\ No newline at end of file
@@ -134,8 +134,30 @@ const Decode = ({ walletAddress, sessionToken, walletConnected }) => {
         responseType: 'blob', // Important for file download
       });
 
+      let fileData = response.data;
+      if ((response.headers['content-type'] || '').includes('application/json')) {
+        // Async contract: the POST returns a job descriptor rather than
+        // the file itself; poll until done, then fetch the result blob
+        const job = JSON.parse(await fileData.text());
+        setPaymentStatus('⏳ Decoding in progress...');
+        for (;;) {
+          const status = await axios.get(`${getApiUrl('')}${job.status_url}`);
+          if (status.data.status === 'done') {
+            break;
+          }
+          if (status.data.status === 'failed') {
+            throw new Error(status.data.error || 'Decoding failed');
+          }
+          await new Promise((resolve) => setTimeout(resolve, 1000));
+        }
+        const resultResponse = await axios.get(`${getApiUrl('')}${job.result_url}`, {
+          responseType: 'blob',
+        });
+        fileData = resultResponse.data;
+      }
+
       // Create download link
-      const url = window.URL.createObjectURL(new Blob([response.data]));
+      const url = window.URL.createObjectURL(new Blob([fileData]));
       const link = document.createElement('a');
       link.href = url;
       link.setAttribute('download', `decoded_message.${fileType === 'text' ? 'txt' : 'png'}`);
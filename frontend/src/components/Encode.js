@@ -147,18 +147,40 @@ const Encode = ({ walletAddress, sessionToken, walletConnected }) => {
       });
 
       if (response.data.success) {
-        setResult(response.data);
+        if (response.data.job_id) {
+          // Async contract: the server replies 202 Accepted with polling
+          // URLs; wait for the job to finish before offering the result
+          setPaymentStatus('Encoding in progress...');
+          await pollJob(response.data.status_url, 'Encoding failed');
+          setResult({ result_url: response.data.result_url });
+        } else {
+          // Synchronous contract: the response carries the download URL
+          setResult({ ...response.data, result_url: response.data.download_url });
+        }
         setPaymentStatus('Encoding completed successfully!');
       }
     } catch (error) {
       console.error('Encoding error:', error);
-      setPaymentStatus('Encoding failed');
+      setPaymentStatus(`Encoding failed: ${error.message}`);
+    }
+  };
+
+  const pollJob = async (statusUrl, failureMessage) => {
+    for (;;) {
+      const status = await axios.get(`${getApiUrl('')}${statusUrl}`);
+      if (status.data.status === 'done') {
+        return;
+      }
+      if (status.data.status === 'failed') {
+        throw new Error(status.data.error || failureMessage);
+      }
+      await new Promise((resolve) => setTimeout(resolve, 1000));
     }
   };
 
   const downloadResult = async () => {
-    if (result && result.download_url) {
-      window.open(`${getApiUrl('')}${result.download_url}`, '_blank');
+    if (result && result.result_url) {
+      window.open(`${getApiUrl('')}${result.result_url}`, '_blank');
     }
   };
 
@@ -350,8 +372,8 @@ const Encode = ({ walletAddress, sessionToken, walletConnected }) => {
         {result && (
           <div className="bg-green-50 border border-green-200 rounded-lg p-4">
             <h3 className="font-semibold text-green-800 mb-2">Encoding Successful!</h3>
-            <p className="text-green-700 mb-2">PGN ID: {result.pgn_id}</p>
-            <p className="text-green-700 mb-4">File Hash: {result.pgn_hash}</p>
+            {result.pgn_id && <p className="text-green-700 mb-2">PGN ID: {result.pgn_id}</p>}
+            {result.pgn_hash && <p className="text-green-700 mb-4">File Hash: {result.pgn_hash}</p>}
             <button
               onClick={downloadResult}
               className="bg-green-500 text-white px-4 py-2 rounded hover:bg-green-600 transition-colors"
@@ -0,0 +1,33 @@
+"""Seeded move permutation shared by the encoder and decoder.
+
+Both sides used to run a full random.shuffle of the legal-move list per
+move just to use (or locate) a single element of the permutation. In a
+backward Fisher-Yates pass, position i is final once step i has run, so
+the walk can stop early: the encoder stops at the index it is encoding
+and the decoder stops when the played move surfaces at its final slot.
+Both stop at the same step, so they consume identical RNG draws and
+stay in sync with each other.
+"""
+
+
+def pick_move(rng, moves, index):
+    """Return the move a full rng.shuffle(moves) would leave at
+    moves[index], running only the Fisher-Yates steps that settle it"""
+    for i in range(len(moves) - 1, 0, -1):
+        j = rng.randrange(i + 1)
+        moves[i], moves[j] = moves[j], moves[i]
+        if i == index:
+            return moves[i]
+    return moves[0]
+
+
+def find_move(rng, moves, played):
+    """Return the index a full rng.shuffle(moves) would assign to the
+    played move, consuming exactly the draws pick_move consumed for it,
+    or None if the move is not in the list"""
+    for i in range(len(moves) - 1, 0, -1):
+        j = rng.randrange(i + 1)
+        moves[i], moves[j] = moves[j], moves[i]
+        if moves[i] == played:
+            return i
+    return 0 if moves[0] == played else None
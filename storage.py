@@ -0,0 +1,88 @@
+import json
+import sqlite3
+import threading
+from typing import Any, Callable, Iterator
+
+
+class SQLiteStore:
+    """Dict-like key-value store persisted in a SQLite table.
+
+    The database runs in WAL mode so readers never block the writer and
+    commits avoid the full fsync-per-transaction cost of rollback
+    journaling. Lookups are O(1) via the primary-key index, and records
+    survive process restarts, which the in-memory dict stores did not.
+    """
+
+    def __init__(self, db_path: str, table: str,
+                 dumps: Callable[[Any], str] = json.dumps,
+                 loads: Callable[[str], Any] = json.loads):
+        self._table = table
+        self._dumps = dumps
+        self._loads = loads
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {table} "
+            "(key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self._conn.commit()
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        with self._lock:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO {self._table} (key, value) VALUES (?, ?)",
+                (key, self._dumps(value)))
+            self._conn.commit()
+
+    def __getitem__(self, key: str) -> Any:
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT value FROM {self._table} WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return self._loads(row[0])
+
+    def get(self, key: str, default: Any = None) -> Any:
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT 1 FROM {self._table} WHERE key = ?", (key,)).fetchone()
+        return row is not None
+
+    def __len__(self) -> int:
+        with self._lock:
+            (count,) = self._conn.execute(
+                f"SELECT COUNT(*) FROM {self._table}").fetchone()
+        return count
+
+    def __delitem__(self, key: str) -> None:
+        with self._lock:
+            cursor = self._conn.execute(
+                f"DELETE FROM {self._table} WHERE key = ?", (key,))
+            self._conn.commit()
+        if cursor.rowcount == 0:
+            raise KeyError(key)
+
+    def keys(self) -> Iterator[str]:
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT key FROM {self._table}").fetchall()
+        return iter(row[0] for row in rows)
+
+    def values(self) -> Iterator[Any]:
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT value FROM {self._table}").fetchall()
+        return iter(self._loads(row[0]) for row in rows)
+
+    def items(self) -> Iterator[tuple]:
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT key, value FROM {self._table}").fetchall()
+        return iter((row[0], self._loads(row[1])) for row in rows)